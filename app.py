@@ -1,6 +1,11 @@
 import asyncio
+import atexit
+import math
 import os
+import signal
+import sys
 import threading
+import time
 from flask import Flask, request, jsonify, send_file, abort
 from config import Config
 from telegram_service import telegram_service
@@ -34,6 +39,29 @@ def run_async(coro):
     except Exception as e:
         return {"success": False, "message": f"Error: {str(e)}"}
 
+@atexit.register
+def shutdown_telegram():
+    """Disconnect clients and flush checkpointed sessions on exit"""
+    if loop is None or loop.is_closed():
+        telegram_service.checkpoint_sessions()
+        return
+    
+    if loop.is_running():
+        # A request thread owns the loop; flush on it so sessions are not read mid-update
+        future = asyncio.run_coroutine_threadsafe(telegram_service.flush_sessions(), loop)
+        try:
+            future.result(timeout=10)
+            return
+        except Exception as e:
+            future.cancel()
+            if loop.is_running():
+                return
+    
+    try:
+        loop.run_until_complete(telegram_service.close())
+    except Exception as e:
+        pass
+
 @app.route('/')
 def home():
     """Health check endpoint"""
@@ -89,6 +117,10 @@ def login_endpoint():
                 # Add entries count if available (for data extracted from messages)
                 if "entries_count" in file_info:
                     response_data["entries_in_file"] = file_info["entries_count"]
+                
+                # Small results are returned inline; the file is only created on download
+                if "lines" in file_info:
+                    response_data["lines"] = file_info["lines"]
             
             return jsonify(response_data)
         else:
@@ -142,6 +174,10 @@ def password_endpoint():
                 # Add entries count if available (for data extracted from messages)
                 if "entries_count" in file_info:
                     response_data["entries_in_file"] = file_info["entries_count"]
+                
+                # Small results are returned inline; the file is only created on download
+                if "lines" in file_info:
+                    response_data["lines"] = file_info["lines"]
             
             return jsonify(response_data)
         else:
@@ -196,6 +232,10 @@ def mail_endpoint():
                 # Add entries count if available (for data extracted from messages)
                 if "entries_count" in file_info:
                     response_data["entries_in_file"] = file_info["entries_count"]
+                
+                # Small results are returned inline; the file is only created on download
+                if "lines" in file_info:
+                    response_data["lines"] = file_info["lines"]
             
             return jsonify(response_data)
         else:
@@ -216,7 +256,11 @@ def download_file(filename):
     File download endpoint
     """
     try:
-        file_path = os.path.join(Config.DOWNLOAD_FOLDER, filename)
+        file_entry = telegram_service.get_file(filename)
+        if file_entry:
+            file_path = telegram_service.materialize_file(file_entry)
+        else:
+            file_path = os.path.join(Config.DOWNLOAD_FOLDER, filename)
         
         if not os.path.exists(file_path):
             abort(404)
@@ -239,26 +283,36 @@ def list_files():
     List all downloaded files with deletion schedule info
     """
     try:
-        if not os.path.exists(Config.DOWNLOAD_FOLDER):
-            return jsonify({
-                "success": True,
-                "files": [],
-                "auto_deletion_info": run_async(telegram_service.get_file_deletion_info())
+        files = []
+        now = time.time()
+        # The shared file index lets every worker report the same files
+        indexed_filenames = set()
+        for file_entry in telegram_service.list_files():
+            indexed_filenames.add(file_entry["filename"])
+            expires_at = file_entry["expires_at"]
+            scheduled_for_deletion = expires_at is not None
+            
+            files.append({
+                "filename": file_entry["filename"],
+                "download_url": f"{Config.BASE_URL}/download/{file_entry['filename']}",
+                "size": file_entry["file_size"],
+                "scheduled_for_deletion": scheduled_for_deletion,
+                "auto_delete_in_minutes": math.ceil(max(0, expires_at - now) / 60) if scheduled_for_deletion else None
             })
         
-        files = []
-        for filename in os.listdir(Config.DOWNLOAD_FOLDER):
-            file_path = os.path.join(Config.DOWNLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                # Check if file is scheduled for deletion
-                scheduled_for_deletion = filename in telegram_service.file_deletion_timers
+        # Files on disk from before a restart or written without the index
+        if os.path.exists(Config.DOWNLOAD_FOLDER):
+            for filename in os.listdir(Config.DOWNLOAD_FOLDER):
+                file_path = os.path.join(Config.DOWNLOAD_FOLDER, filename)
+                if filename in indexed_filenames or filename.endswith('.tmp') or not os.path.isfile(file_path):
+                    continue
                 
                 files.append({
                     "filename": filename,
                     "download_url": f"{Config.BASE_URL}/download/{filename}",
                     "size": os.path.getsize(file_path),
-                    "scheduled_for_deletion": scheduled_for_deletion,
-                    "auto_delete_in_minutes": 10 if scheduled_for_deletion else None
+                    "scheduled_for_deletion": False,
+                    "auto_delete_in_minutes": None
                 })
         
         return jsonify({
@@ -329,6 +383,8 @@ def internal_error(error):
 
 if __name__ == '__main__':
     Config.create_download_dir()
+    # Exit through SystemExit on SIGTERM so the atexit shutdown hook runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(
         host=Config.HOST,
         port=Config.PORT,
@@ -19,18 +19,55 @@ class Config:
     BOT_USERNAME = os.getenv('BOT_USERNAME', 'TTMlogsBot')
     SESSION_NAME = os.getenv('SESSION_NAME', 'leak_data_session')
     
+    # Comma-separated lists for the client pool; the n-th phone logs in the n-th session
+    SESSION_NAMES = [name.strip() for name in os.getenv('SESSION_NAMES', SESSION_NAME).split(',') if name.strip()]
+    TELEGRAM_PHONES = [phone.strip() for phone in os.getenv('TELEGRAM_PHONES', TELEGRAM_PHONE).split(',') if phone.strip()] or [TELEGRAM_PHONE]
+    # FloodWaits above this many seconds raise instead of sleeping, so the pool can fail over
+    FLOOD_SLEEP_THRESHOLD = int(os.getenv('FLOOD_SLEEP_THRESHOLD', '0'))
+    
+    # 'sqlite' uses Telethon's default session file; 'checkpoint' keeps the session in memory
+    # and writes it to <session>.session.json every SESSION_CHECKPOINT_INTERVAL seconds
+    SESSION_MODE = os.getenv('SESSION_MODE', 'sqlite').lower()
+    SESSION_CHECKPOINT_INTERVAL = int(os.getenv('SESSION_CHECKPOINT_INTERVAL', '30'))
+    
+    # Send a duplicate query to a second bot once the first is slower than HEDGE_PERCENTILE
+    # of its recent latency; each request earns HEDGE_BUDGET of a hedge, and at most HEDGE_BURST
+    # unused hedges are banked so a long quiet period cannot fund hedging every request later
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'False').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.95'))
+    HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.1'))
+    HEDGE_BURST = float(os.getenv('HEDGE_BURST', '5'))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    HEDGE_LATENCY_WINDOW = int(os.getenv('HEDGE_LATENCY_WINDOW', '200'))
+    
     DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
     HOST = os.getenv('FLASK_HOST', '0.0.0.0')
     PORT = int(os.getenv('FLASK_PORT', '5000'))
     
     DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', 'downloads')
     BASE_URL = os.getenv('BASE_URL', 'https://leakcheck-backend1-production.up.railway.app')
+    # Results up to these limits are returned in the JSON and only written to disk on /download
+    INLINE_RESULT_MAX_LINES = int(os.getenv('INLINE_RESULT_MAX_LINES', '50'))
+    INLINE_RESULT_MAX_BYTES = int(os.getenv('INLINE_RESULT_MAX_BYTES', '8192'))
+    FILE_TTL_SECONDS = int(os.getenv('FILE_TTL_SECONDS', '600'))
+    FILE_SWEEP_INTERVAL = int(os.getenv('FILE_SWEEP_INTERVAL', '15'))
+    
+    # 'memory' keeps state in-process; 'sqlite' shares it between workers via STATE_DB_PATH
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory').lower()
+    STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'leak_data_state.db')
     
     @staticmethod
     def create_download_dir():
         if not os.path.exists(Config.DOWNLOAD_FOLDER):
             os.makedirs(Config.DOWNLOAD_FOLDER)
 
+# Each pooled session needs its own account, otherwise the pool shares one rate limit
+if len(Config.SESSION_NAMES) > 1 and len(Config.TELEGRAM_PHONES) != len(Config.SESSION_NAMES):
+    raise ValueError(
+        f"TELEGRAM_PHONES has {len(Config.TELEGRAM_PHONES)} entries but SESSION_NAMES has "
+        f"{len(Config.SESSION_NAMES)}; configure one phone per session"
+    )
+
 
 
 
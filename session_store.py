@@ -0,0 +1,163 @@
+import asyncio
+import datetime
+import json
+import os
+import threading
+from typing import Dict, Any, Tuple
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.tl.types.updates import State
+
+class CheckpointSession(MemorySession):
+    """
+    Telethon session kept in memory and checkpointed to a JSON file.
+    Entity and update-state changes only mark the session dirty; they are
+    flushed by run_checkpoints() on an interval and by close() at shutdown.
+    Auth and DC changes are flushed immediately so a login is never lost.
+    """
+    def __init__(self, session_name: str):
+        super().__init__()
+        self.session_name = session_name
+        self.checkpoint_path = f"{session_name}.session.json"
+        self.dirty = False
+        self.write_lock = threading.Lock()
+        self.generation = 0
+        self.written_generation = 0
+
+        if os.path.exists(self.checkpoint_path):
+            self._load_checkpoint()
+        elif os.path.exists(f"{session_name}.session"):
+            self._import_sqlite_session()
+
+    def _load_checkpoint(self):
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        self._dc_id = data.get("dc_id", 0)
+        self._server_address = data.get("server_address")
+        self._port = data.get("port")
+        self._takeout_id = data.get("takeout_id")
+        if data.get("auth_key"):
+            self._auth_key = AuthKey(data=bytes.fromhex(data["auth_key"]))
+
+        self._entities = set(tuple(row) for row in data.get("entities", []))
+        for entity_id, (pts, qts, date, seq, unread_count) in data.get("update_states", {}).items():
+            self._update_states[int(entity_id)] = State(
+                pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count
+            )
+
+    def _import_sqlite_session(self):
+        # One-off migration so switching modes keeps the existing login
+        sqlite_session = SQLiteSession(self.session_name)
+        try:
+            self._dc_id = sqlite_session.dc_id
+            self._server_address = sqlite_session.server_address
+            self._port = sqlite_session.port
+            self._auth_key = sqlite_session.auth_key
+            self._takeout_id = sqlite_session.takeout_id
+
+            cursor = sqlite_session._cursor()
+            try:
+                rows = cursor.execute('select id, hash, username, phone, name from entities').fetchall()
+                self._entities = set(tuple(row) for row in rows)
+            finally:
+                cursor.close()
+
+            for entity_id, state in sqlite_session.get_update_states():
+                self._update_states[entity_id] = state
+        finally:
+            sqlite_session.close()
+
+        self.checkpoint()
+
+    def set_dc(self, dc_id, server_address, port):
+        changed = (dc_id or 0, server_address, port) != (self._dc_id, self._server_address, self._port)
+        super().set_dc(dc_id, server_address, port)
+        if changed:
+            self.checkpoint()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        changed = (value.key if value else None) != (self._auth_key.key if self._auth_key else None)
+        self._auth_key = value
+        if changed:
+            self.checkpoint()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self.dirty = True
+
+    def process_entities(self, tlo):
+        rows = set(self._entities_to_rows(tlo))
+        if not rows <= self._entities:
+            self._entities |= rows
+            self.dirty = True
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.dirty = True
+
+    def save(self):
+        # Telethon calls save() during downloads and update handling; defer to the checkpoint loop
+        self.dirty = True
+
+    def close(self):
+        if self.dirty:
+            self.checkpoint()
+
+    def delete(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        self.generation += 1
+        return self.generation, {
+            "dc_id": self._dc_id,
+            "server_address": self._server_address,
+            "port": self._port,
+            "takeout_id": self._takeout_id,
+            "auth_key": self._auth_key.key.hex() if self._auth_key else None,
+            "entities": [list(row) for row in self._entities],
+            "update_states": {
+                str(entity_id): [state.pts, state.qts, state.date.timestamp(), state.seq, state.unread_count]
+                for entity_id, state in self._update_states.items()
+            }
+        }
+
+    def _write_snapshot(self, generation: int, snapshot: Dict[str, Any]):
+        with self.write_lock:
+            # A synchronous checkpoint may have written newer state while this one waited
+            if generation <= self.written_generation:
+                return
+            temp_path = f"{self.checkpoint_path}.tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.checkpoint_path)
+            self.written_generation = generation
+
+    def checkpoint(self):
+        self.dirty = False
+        try:
+            self._write_snapshot(*self._snapshot())
+        except Exception:
+            self.dirty = True
+            raise
+
+    async def run_checkpoints(self, interval: float):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if not self.dirty:
+                continue
+
+            # Take the snapshot on the event loop, write it from a worker thread
+            self.dirty = False
+            generation, snapshot = self._snapshot()
+            try:
+                await loop.run_in_executor(None, self._write_snapshot, generation, snapshot)
+            except Exception as e:
+                self.dirty = True
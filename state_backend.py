@@ -0,0 +1,256 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List
+from config import Config
+
+class StateBackend(ABC):
+    @abstractmethod
+    def register_file(self, filename: str, file_path: str, file_size: int, expires_at: Optional[float],
+                      content: Optional[str] = None):
+        pass
+
+    @abstractmethod
+    def get_file(self, filename: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def list_files(self) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def remove_file(self, filename: str):
+        pass
+
+    @abstractmethod
+    def cancel_expiry(self, filename: str) -> bool:
+        pass
+
+    @abstractmethod
+    def pop_expired(self, now: float) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def increment_counter(self, name: str, amount: int = 1) -> int:
+        pass
+
+    @abstractmethod
+    def increment_counters(self, amounts: Dict[str, int]):
+        # Apply several counter increments in one atomic update
+        pass
+
+    @abstractmethod
+    def get_counters(self, prefix: str = "") -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    def adjust_tokens(self, name: str, amount: float, capacity: float) -> bool:
+        # Atomically add amount to a token bucket capped at capacity; refuse if it would go negative
+        pass
+
+class MemoryStateBackend(StateBackend):
+    def __init__(self):
+        self.files = {}
+        self.counters = {}
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def register_file(self, filename: str, file_path: str, file_size: int, expires_at: Optional[float],
+                      content: Optional[str] = None):
+        with self.lock:
+            self.files[filename] = {
+                "filename": filename,
+                "file_path": file_path,
+                "file_size": file_size,
+                "expires_at": expires_at,
+                "content": content
+            }
+
+    def get_file(self, filename: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.files.get(filename)
+            return dict(entry) if entry else None
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(entry) for entry in self.files.values()]
+
+    def remove_file(self, filename: str):
+        with self.lock:
+            self.files.pop(filename, None)
+
+    def cancel_expiry(self, filename: str) -> bool:
+        with self.lock:
+            entry = self.files.get(filename)
+            if not entry or entry["expires_at"] is None:
+                return False
+            entry["expires_at"] = None
+            return True
+
+    def pop_expired(self, now: float) -> List[Dict[str, Any]]:
+        with self.lock:
+            expired = [entry for entry in self.files.values()
+                       if entry["expires_at"] is not None and entry["expires_at"] <= now]
+            for entry in expired:
+                del self.files[entry["filename"]]
+            return expired
+
+    def increment_counter(self, name: str, amount: int = 1) -> int:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            return self.counters[name]
+
+    def increment_counters(self, amounts: Dict[str, int]):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_counters(self, prefix: str = "") -> Dict[str, int]:
+        with self.lock:
+            return {name[len(prefix):]: value for name, value in self.counters.items() if name.startswith(prefix)}
+
+    def adjust_tokens(self, name: str, amount: float, capacity: float) -> bool:
+        with self.lock:
+            tokens = min(capacity, self.tokens.get(name, 0.0) + amount)
+            if tokens < 0:
+                return False
+            self.tokens[name] = tokens
+            return True
+
+class SQLiteStateBackend(StateBackend):
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "filename TEXT PRIMARY KEY, file_path TEXT NOT NULL, "
+                "file_size INTEGER NOT NULL, expires_at REAL, content TEXT)"
+            )
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(files)")]
+            if "content" not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN content TEXT")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS token_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL)")
+
+    def _connect(self):
+        # A fresh connection per call keeps this safe across threads and worker processes
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL stays consistent with NORMAL; a power loss can only drop the latest commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return _ClosingConnection(conn)
+
+    def register_file(self, filename: str, file_path: str, file_size: int, expires_at: Optional[float],
+                      content: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (filename, file_path, file_size, expires_at, content) VALUES (?, ?, ?, ?, ?)",
+                (filename, file_path, file_size, expires_at, content)
+            )
+
+    def get_file(self, filename: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM files WHERE filename = ?", (filename,)).fetchone()
+            return dict(row) if row else None
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM files ORDER BY filename")]
+
+    def remove_file(self, filename: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def cancel_expiry(self, filename: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE files SET expires_at = NULL WHERE filename = ? AND expires_at IS NOT NULL",
+                (filename,)
+            )
+            return cursor.rowcount > 0
+
+    def pop_expired(self, now: float) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            # Claim and delete in one write transaction so only one worker removes each file
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = [dict(row) for row in conn.execute(
+                    "SELECT * FROM files WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+                )]
+                conn.execute("DELETE FROM files WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return expired
+
+    def increment_counter(self, name: str, amount: int = 1) -> int:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (name, amount)
+                )
+                value = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return value
+
+    def increment_counters(self, amounts: Dict[str, int]):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(amounts.items())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_counters(self, prefix: str = "") -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?",
+                (len(prefix), prefix)
+            )
+            return {row["name"][len(prefix):]: row["value"] for row in rows}
+
+    def adjust_tokens(self, name: str, amount: float, capacity: float) -> bool:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens FROM token_buckets WHERE name = ?", (name,)).fetchone()
+                tokens = min(capacity, (row["tokens"] if row else 0.0) + amount)
+                if tokens < 0:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute("INSERT OR REPLACE INTO token_buckets (name, tokens) VALUES (?, ?)", (name, tokens))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return True
+
+class _ClosingConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.close()
+
+def create_state_backend() -> StateBackend:
+    if Config.STATE_BACKEND == 'sqlite':
+        return SQLiteStateBackend(Config.STATE_DB_PATH)
+    return MemoryStateBackend()
@@ -1,111 +1,359 @@
 import asyncio
 import os
 import re
+import tempfile
 import threading
 import time
+from collections import deque
 from typing import Optional, Dict, Any
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.types import Message, DocumentAttributeFilename
 import aiofiles
 from config import Config
+from session_store import CheckpointSession
+from state_backend import StateBackend, create_state_backend
+
+class TelegramAccount:
+    def __init__(self, session_name: str, phone: str):
+        self.session_name = session_name
+        self.phone = phone
+        self.client = None
+        self.checkpoint_task = None
+        self.bot_entities = {}
+        self.flood_wait_count = 0
+        self.flood_wait_until = 0.0
+    
+    def is_available(self) -> bool:
+        return time.time() >= self.flood_wait_until
+    
+    def mark_flood_wait(self, seconds: int):
+        self.flood_wait_count += 1
+        self.flood_wait_until = max(self.flood_wait_until, time.time() + seconds)
+    
+    def get_stats(self, request_count: int) -> Dict[str, Any]:
+        return {
+            "session": self.session_name,
+            "connected": self.client is not None,
+            "bots": list(self.bot_entities.keys()),
+            "request_count": request_count,
+            "flood_wait_count": self.flood_wait_count,
+            "flood_wait_remaining": max(0, int(self.flood_wait_until - time.time()))
+        }
 
 class TelegramService:
-    def __init__(self):
+    def __init__(self, state: Optional[StateBackend] = None):
         self.client = None
+        self.accounts = []
+        self.bot_pairs = []
         self.bot_entities = {}
         self.bot_entity = None
-        self.file_deletion_timers = {}
+        self.state = state or create_state_backend()
+        self.sweeper_thread = None
+        self.sweeper_stop = threading.Event()
+        self.bot_latencies = {}
         self.current_bot_index = 0
-        self.bot_request_counts = {}
         self.lock = threading.Lock()
-        
-    def _schedule_file_deletion(self, file_path: str, filename: str):
-        def delete_file():
+    
+    def _sweep_expired_files(self):
+        while not self.sweeper_stop.wait(Config.FILE_SWEEP_INTERVAL):
             try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if filename in self.file_deletion_timers:
-                    del self.file_deletion_timers[filename]
+                for entry in self.state.pop_expired(time.time()):
+                    if os.path.exists(entry["file_path"]):
+                        os.remove(entry["file_path"])
             except Exception as e:
                 pass
+    
+    def _start_sweeper(self):
+        with self.lock:
+            if self.sweeper_thread and self.sweeper_thread.is_alive():
+                return
+            self.sweeper_stop.clear()
+            self.sweeper_thread = threading.Thread(target=self._sweep_expired_files)
+            self.sweeper_thread.daemon = True
+            self.sweeper_thread.start()
+        
+    def _schedule_file_deletion(self, file_path: str, filename: str, content: Optional[str] = None):
+        if content is not None:
+            file_size = len(content.encode('utf-8'))
+        else:
+            file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        self.state.register_file(filename, file_path, file_size, time.time() + Config.FILE_TTL_SECONDS, content)
+        self._start_sweeper()
+    
+    async def _register_result_file(self, file_path: str, filename: str, content: Optional[str] = None):
+        # Shielded so a cancelled hedge loser still indexes a file it already wrote
+        await asyncio.shield(self._run_state(self._schedule_file_deletion, file_path, filename, content))
+    
+    def _is_inline_result(self, data_lines: list, file_content: str) -> bool:
+        return (len(data_lines) <= Config.INLINE_RESULT_MAX_LINES and
+                len(file_content.encode('utf-8')) <= Config.INLINE_RESULT_MAX_BYTES)
+    
+    def get_file(self, filename: str) -> Optional[Dict[str, Any]]:
+        return self.state.get_file(filename)
+    
+    def materialize_file(self, file_entry: Dict[str, Any]) -> str:
+        # Inline results are only written to disk once someone actually downloads them
+        file_path = file_entry["file_path"]
+        if file_entry.get("content") is None or os.path.exists(file_path):
+            return file_path
         
-        if filename in self.file_deletion_timers:
-            self.file_deletion_timers[filename].cancel()
+        Config.create_download_dir()
+        # Unique temp file per call so concurrent downloads of one result cannot collide
+        fd, temp_path = tempfile.mkstemp(dir=Config.DOWNLOAD_FOLDER, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(file_entry["content"])
+            os.replace(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
         
-        timer = threading.Timer(600, delete_file)
-        timer.daemon = True
-        timer.start()
-        self.file_deletion_timers[filename] = timer
+        self.state.register_file(file_entry["filename"], file_path, os.path.getsize(file_path), file_entry["expires_at"])
+        return file_path
+    
+    def list_files(self) -> list:
+        return self.state.list_files()
         
-    async def initialize(self):
+    async def _initialize_account(self, account: TelegramAccount) -> bool:
+        client = None
         try:
-            self.client = TelegramClient(
-                Config.SESSION_NAME,
+            if Config.SESSION_MODE == 'checkpoint':
+                session = CheckpointSession(account.session_name)
+            else:
+                session = account.session_name
+            
+            client = TelegramClient(
+                session,
                 Config.TELEGRAM_API_ID,
-                Config.TELEGRAM_API_HASH
+                Config.TELEGRAM_API_HASH,
+                flood_sleep_threshold=Config.FLOOD_SLEEP_THRESHOLD
             )
             
-            await self.client.start(phone=Config.TELEGRAM_PHONE)
+            await client.start(phone=account.phone)
+            account.client = client
+            
+            if isinstance(session, CheckpointSession):
+                account.checkpoint_task = asyncio.ensure_future(session.run_checkpoints(Config.SESSION_CHECKPOINT_INTERVAL))
             
             for bot_username in Config.BOT_USERNAMES:
                 try:
-                    entity = await self.client.get_entity(bot_username)
-                    self.bot_entities[bot_username] = entity
-                    self.bot_request_counts[bot_username] = 0
+                    entity = await client.get_entity(bot_username)
+                    account.bot_entities[bot_username] = entity
                 except Exception as e:
                     pass
             
-            if not self.bot_entities:
+            if account.bot_entities:
+                return True
+            
+        except Exception as e:
+            pass
+        
+        # Unused accounts are never added to the pool, so release them here
+        if account.checkpoint_task:
+            account.checkpoint_task.cancel()
+            account.checkpoint_task = None
+        if client:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                pass
+        account.client = None
+        return False
+    
+    async def initialize(self):
+        try:
+            self.accounts = []
+            for index, session_name in enumerate(Config.SESSION_NAMES):
+                account = TelegramAccount(session_name, Config.TELEGRAM_PHONES[index])
+                if await self._initialize_account(account):
+                    self.accounts.append(account)
+            
+            # Interleave accounts per bot so consecutive requests land on different accounts
+            self.bot_pairs = []
+            self.bot_entities = {}
+            for bot_username in Config.BOT_USERNAMES:
+                for account in self.accounts:
+                    if bot_username in account.bot_entities:
+                        self.bot_pairs.append((account, bot_username))
+                        self.bot_entities.setdefault(bot_username, account.bot_entities[bot_username])
+            
+            if not self.bot_pairs:
                 return False
             
+            self.client = self.accounts[0].client
             self.bot_entity = list(self.bot_entities.values())[0]
             return True
             
         except Exception as e:
             return False
     
-    def _get_next_bot(self):
+    async def _run_state(self, func, *args):
+        # Shared state may hit disk (SQLite backend); keep it off the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+    
+    def _get_next_bot(self, exclude=(), exclude_bots=()):
+        # The round-robin index is per process; only the request statistics are shared
         with self.lock:
-            if not self.bot_entities:
-                return None, None
+            if not self.bot_pairs:
+                return None, None, None
             
-            bot_usernames = list(self.bot_entities.keys())
-            selected_bot = bot_usernames[self.current_bot_index % len(bot_usernames)]
-            self.current_bot_index += 1
-            self.bot_request_counts[selected_bot] += 1
+            for _ in range(len(self.bot_pairs)):
+                account, selected_bot = self.bot_pairs[self.current_bot_index % len(self.bot_pairs)]
+                self.current_bot_index += 1
+                if (account, selected_bot) in exclude or selected_bot in exclude_bots or not account.is_available():
+                    continue
+                
+                return account, selected_bot, account.bot_entities[selected_bot]
             
-            return selected_bot, self.bot_entities[selected_bot]
+            return None, None, None
+    
+    async def _send_to_next_bot(self, command: str, exclude_bots=(), hedge: bool = False):
+        tried = set()
+        reserved = False
+        sent = None
+        try:
+            while True:
+                account, bot_username, bot_entity = self._get_next_bot(exclude=tried, exclude_bots=exclude_bots)
+                if not bot_entity:
+                    return None
+                
+                # Only spend hedge budget once there is a bot to hedge to
+                if hedge and not reserved:
+                    if not await self._reserve_hedge():
+                        return None
+                    reserved = True
+                
+                await self._run_state(self.state.increment_counters, {
+                    f"account:{account.session_name}": 1,
+                    f"bot:{bot_username}": 1
+                })
+                
+                try:
+                    sent = await account.client.send_message(bot_entity, command)
+                except FloodWaitError as e:
+                    account.mark_flood_wait(e.seconds)
+                    tried.add((account, bot_username))
+                    continue
+                
+                if hedge:
+                    await self._run_state(self.state.increment_counter, "hedge:hedged")
+                return account, bot_username, bot_entity, sent
+        finally:
+            if reserved and sent is None:
+                await self._run_state(self.state.adjust_tokens, "hedge", 1, Config.HEDGE_BURST)
+    
+    async def _query_bot(self, target, command: str, timeout: int, query_type: str, search_term: str, exclude_bots=()) -> Dict[str, Any]:
+        while True:
+            account, bot_username, bot_entity, sent = target
+            started = time.monotonic()
+            flooded = False
+            try:
+                return await self._wait_for_bot_response(timeout, query_type, search_term, bot_entity, account.client, sent.id)
+            except FloodWaitError as e:
+                # Polling or download hit a flood limit; move the query to another pair
+                flooded = True
+                account.mark_flood_wait(e.seconds)
+            finally:
+                # A cancelled hedge loser still records its elapsed time as a lower bound
+                if not flooded:
+                    with self.lock:
+                        latencies = self.bot_latencies.setdefault(bot_username, deque(maxlen=Config.HEDGE_LATENCY_WINDOW))
+                        latencies.append(time.monotonic() - started)
+            
+            target = await self._send_to_next_bot(command, exclude_bots=exclude_bots)
+            if not target:
+                return {
+                    "success": False,
+                    "message": "No bots available"
+                }
+    
+    def _get_hedge_delay(self, bot_username: str) -> Optional[float]:
+        if not Config.HEDGE_ENABLED:
+            return None
+        
+        with self.lock:
+            latencies = sorted(self.bot_latencies.get(bot_username, ()))
+        
+        if len(latencies) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        
+        index = min(len(latencies) - 1, int(Config.HEDGE_PERCENTILE * len(latencies)))
+        return latencies[index]
+    
+    async def _reserve_hedge(self) -> bool:
+        # Shared token bucket keeps hedged sends within HEDGE_BUDGET across all workers
+        return await self._run_state(self.state.adjust_tokens, "hedge", -1, Config.HEDGE_BURST)
     
     async def send_command_and_wait(self, command: str, query_type: str = "search", search_term: str = "", timeout: int = 30) -> Dict[str, Any]:
+        tasks = set()
         try:
-            if not self.client or not self.bot_entities:
+            if not self.accounts or not self.bot_pairs:
                 return {
                     "success": False,
                     "message": "Telegram client not initialized"
                 }
             
-            bot_username, bot_entity = self._get_next_bot()
-            if not bot_entity:
+            primary = await self._send_to_next_bot(command)
+            if not primary:
                 return {
                     "success": False,
                     "message": "No bots available"
                 }
             
-            await self.client.send_message(bot_entity, command)
-            response_data = await self._wait_for_bot_response(timeout, query_type, search_term, bot_entity)
+            if Config.HEDGE_ENABLED:
+                await self._run_state(self.state.adjust_tokens, "hedge", Config.HEDGE_BUDGET, Config.HEDGE_BURST)
+            primary_task = asyncio.ensure_future(self._query_bot(primary, command, timeout, query_type, search_term))
+            tasks.add(primary_task)
+            
+            hedge_delay = self._get_hedge_delay(primary[1])
+            if hedge_delay is None:
+                return await primary_task
+            
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done:
+                return await primary_task
+            
+            hedge = await self._send_to_next_bot(command, exclude_bots={primary[1]}, hedge=True)
+            if not hedge:
+                return await primary_task
+            
+            hedge_task = asyncio.ensure_future(self._query_bot(hedge, command, timeout, query_type, search_term, exclude_bots={primary[1]}))
+            tasks.add(hedge_task)
+            
+            # Take the first successful answer; a failure only wins if both bots fail
+            winner = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None or (task.result().get("success") and not winner.result().get("success")):
+                        winner = task
+                if winner.result().get("success"):
+                    break
             
-            return response_data
+            if winner is hedge_task:
+                await self._run_state(self.state.increment_counter, "hedge:wins")
+            
+            return winner.result()
             
         except Exception as e:
             return {
                 "success": False,
                 "message": f"Error sending command: {str(e)}"
             }
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
     
-    async def _wait_for_bot_response(self, timeout: int, query_type: str = "search", search_term: str = "", bot_entity=None) -> Dict[str, Any]:
+    async def _wait_for_bot_response(self, timeout: int, query_type: str = "search", search_term: str = "", bot_entity=None, client=None, min_id: int = 0) -> Dict[str, Any]:
         try:
             if bot_entity is None:
                 bot_entity = self.bot_entity
+            if client is None:
+                client = self.client
             
             max_attempts = 8
             messages = []
@@ -113,7 +361,10 @@ class TelegramService:
                 await asyncio.sleep(0.5)
                 
                 messages = []
-                async for message in self.client.iter_messages(bot_entity, limit=10):
+                # Only replies newer than our command, so a late answer to another query is never reused
+                async for message in client.iter_messages(bot_entity, limit=10, min_id=min_id):
+                    if message.out:
+                        continue
                     if message.date and (message.date.timestamp() > (asyncio.get_event_loop().time() - timeout)):
                         messages.append(message)
                 
@@ -158,7 +409,9 @@ class TelegramService:
                         for poll_attempt in range(4):
                             await asyncio.sleep(0.5)
                             updated_messages = []
-                            async for message in self.client.iter_messages(self.bot_entity, limit=10):
+                            async for message in client.iter_messages(bot_entity, limit=10, min_id=min_id):
+                                if message.out:
+                                    continue
                                 if message.date and (message.date.timestamp() > (asyncio.get_event_loop().time() - timeout)):
                                     updated_messages.append(message)
                             
@@ -169,7 +422,7 @@ class TelegramService:
                     updated_messages = messages if latest_file_message else messages
                     updated_messages.sort(key=lambda x: x.date, reverse=True)
                     
-                    file_info = await self._find_file_in_messages(updated_messages, query_type, search_term, bot_entity)
+                    file_info = await self._find_file_in_messages(updated_messages, query_type, search_term, bot_entity, client)
                     
                     if file_info:
                         return {
@@ -211,6 +464,8 @@ class TelegramService:
                 "raw_response": latest_message.text
             }
             
+        except FloodWaitError:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -276,8 +531,6 @@ class TelegramService:
             else:
                 new_filename = "data.txt"
             
-            Config.create_download_dir()
-            
             timestamp = str(int(asyncio.get_event_loop().time()))
             safe_filename = f"{timestamp}_{new_filename}"
             file_path = os.path.join(Config.DOWNLOAD_FOLDER, safe_filename)
@@ -287,13 +540,30 @@ class TelegramService:
             file_content += f"# Found: {count} entries\n"
             file_content += f"# Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
             file_content += '\n'.join(data_lines)
+            download_url = f"{Config.BASE_URL}/download/{safe_filename}"
+            
+            if self._is_inline_result(data_lines, file_content):
+                await self._register_result_file(file_path, safe_filename, file_content)
+                return {
+                    "filename": safe_filename,
+                    "original_filename": new_filename,
+                    "display_name": new_filename,
+                    "file_path": file_path,
+                    "download_url": download_url,
+                    "file_size": len(file_content.encode('utf-8')),
+                    "search_term": search_term,
+                    "query_type": query_type,
+                    "entries_count": len(data_lines),
+                    "lines": data_lines
+                }
+            
+            Config.create_download_dir()
             
             with open(file_path, 'w', encoding='utf-8') as f:
                 f.write(file_content)
             
             file_size = os.path.getsize(file_path)
-            self._schedule_file_deletion(file_path, safe_filename)
-            download_url = f"{Config.BASE_URL}/download/{safe_filename}"
+            await self._register_result_file(file_path, safe_filename)
             
             return {
                 "filename": safe_filename,
@@ -310,8 +580,11 @@ class TelegramService:
         except Exception as e:
             return None
     
-    async def _find_file_in_messages(self, messages, query_type: str = "search", search_term: str = "", bot_entity=None) -> Optional[Dict[str, Any]]:
+    async def _find_file_in_messages(self, messages, query_type: str = "search", search_term: str = "", bot_entity=None, client=None) -> Optional[Dict[str, Any]]:
         try:
+            if client is None:
+                client = self.client
+            
             for message in messages:
                 if message.text and not message.document:
                     continue
@@ -343,7 +616,13 @@ class TelegramService:
                     file_path = os.path.join(Config.DOWNLOAD_FOLDER, safe_filename)
                     
                     temp_path = file_path + ".tmp"
-                    await self.client.download_media(message.document, temp_path)
+                    try:
+                        await client.download_media(message.document, temp_path)
+                    except (asyncio.CancelledError, FloodWaitError):
+                        # Cancelled or flood-limited downloads leave a partial file that is not indexed
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                        raise
                     
                     try:
                         with open(temp_path, 'r', encoding='utf-8', errors='ignore') as temp_file:
@@ -360,7 +639,7 @@ class TelegramService:
                         if os.path.exists(temp_path):
                             os.rename(temp_path, file_path)
                     
-                    self._schedule_file_deletion(file_path, safe_filename)
+                    await self._register_result_file(file_path, safe_filename)
                     download_url = f"{Config.BASE_URL}/download/{safe_filename}"
                     
                     return {
@@ -376,6 +655,8 @@ class TelegramService:
             
             return None
             
+        except FloodWaitError:
+            raise
         except Exception as e:
             return None
     
@@ -392,32 +673,55 @@ class TelegramService:
         return await self.send_command_and_wait(command, "mail", email)
     
     def cancel_file_deletion(self, filename: str) -> bool:
-        if filename in self.file_deletion_timers:
-            self.file_deletion_timers[filename].cancel()
-            del self.file_deletion_timers[filename]
-            return True
-        return False
+        return self.state.cancel_expiry(filename)
     
     def get_file_deletion_info(self) -> Dict[str, Any]:
+        filenames = [entry["filename"] for entry in self.state.list_files() if entry["expires_at"] is not None]
         return {
-            "files_scheduled_for_deletion": len(self.file_deletion_timers),
-            "filenames": list(self.file_deletion_timers.keys())
+            "files_scheduled_for_deletion": len(filenames),
+            "filenames": filenames
         }
     
     def get_bot_stats(self) -> Dict[str, Any]:
+        request_counts = {bot_username: 0 for bot_username in self.bot_entities}
+        request_counts.update(self.state.get_counters("bot:"))
+        account_counts = self.state.get_counters("account:")
+        hedge_counts = self.state.get_counters("hedge:")
         return {
             "total_bots": len(self.bot_entities),
             "available_bots": list(self.bot_entities.keys()),
-            "request_counts": self.bot_request_counts,
-            "total_requests": sum(self.bot_request_counts.values())
+            "request_counts": request_counts,
+            "total_requests": sum(request_counts.values()),
+            "total_accounts": len(self.accounts),
+            "accounts": [account.get_stats(account_counts.get(account.session_name, 0)) for account in self.accounts],
+            "hedging": {
+                "enabled": Config.HEDGE_ENABLED,
+                "hedged_requests": hedge_counts.get("hedged", 0),
+                "hedge_wins": hedge_counts.get("wins", 0)
+            }
         }
     
+    def checkpoint_sessions(self):
+        for account in self.accounts:
+            if account.client and isinstance(account.client.session, CheckpointSession):
+                try:
+                    account.client.session.close()
+                except Exception as e:
+                    pass
+    
+    async def flush_sessions(self):
+        self.checkpoint_sessions()
+    
     async def close(self):
-        for timer in self.file_deletion_timers.values():
-            timer.cancel()
-        self.file_deletion_timers.clear()
+        self.sweeper_stop.set()
         
-        if self.client:
-            await self.client.disconnect()
+        try:
+            for account in self.accounts:
+                if account.checkpoint_task:
+                    account.checkpoint_task.cancel()
+                if account.client:
+                    await account.client.disconnect()
+        finally:
+            self.checkpoint_sessions()
 
 telegram_service = TelegramService()
\ No newline at end of file